@@ -1,49 +1,12 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import os
 import uuid
 import io # To handle file download in memory
 
-# --- Helper Functions (Same as original script) ---
-def convert_kids_friendly(value):
-    """Converts a value to 'true' or 'false' for SQL boolean."""
-    return 'true' if str(value).strip().lower() in ['yes', 'true', '1'] else 'false'
-
-def extract_prep_time(value):
-    """Extracts the second number from a range string like '5-10 mins' and formats as '0:MM'."""
-    try:
-        # Handle potential non-string values, None, NaN gracefully
-        value_str = str(value) if pd.notna(value) else ""
-        if '-' in value_str:
-             # Split by '-' then by space, take the first part of the second split
-            parts = value_str.split('-')
-            if len(parts) > 1:
-                 time_str = parts[1].strip().split()[0]
-                 # Ensure it's a number before returning
-                 if time_str.isdigit():
-                      return f"0:{int(time_str):02d}" # Format with leading zero if needed
-                 else:
-                     return "0:00" # Return default if not a digit
-        return "0:00" # Default if format doesn't match
-    except Exception as e:
-        st.warning(f"Error processing prep time '{value}': {e}")
-        return "0:00" # Return default on error
-
-# --- Main Logic Function ---
-def generate_sql_queries(df, location_id):
-    """Processes the DataFrame and generates all SQL queries."""
-    all_sql_output = []
-
-    # Step 3: Clean column names
-    original_columns = list(df.columns)
-    df.columns = df.columns.astype(str).str.strip().str.lower().str.replace(" ", "_")
-    cleaned_columns = list(df.columns)
-
-    all_sql_output.append(f"-- Original Columns: {original_columns}")
-    all_sql_output.append(f"-- Cleaned Columns: {cleaned_columns}\n")
-
-    # Step 4: Column mapping (using cleaned names)
-    COLUMN_MAP = {
+# Column mapping (using cleaned names)
+COLUMN_MAP = {
     "item_id": "item_id",
     "item_name": "item_name",
     "average_prep_time": "average_preparation_time",
@@ -55,186 +18,197 @@ def generate_sql_queries(df, location_id):
     "pairing_recommendation": "pairing_recommendation"
 }
 
+# --- Helper Functions (Same as original script) ---
+def clean_column_name(name):
+    """Cleans an Excel header the same way as the DataFrame columns: trimmed, lower-case, spaces as underscores."""
+    return str(name).strip().lower().replace(" ", "_")
+
+def convert_kids_friendly(values):
+    """Converts each value to 'true' or 'false' for SQL boolean."""
+    is_yes = values.str.strip().str.lower().isin(['yes', 'true', '1'])
+    return pd.Series(np.where(is_yes, 'true', 'false'), index=values.index)
+
+def extract_prep_time(values):
+    """Extracts the second number from range strings like '5-10 mins' and formats each as '0:MM'."""
+    # Anything without a '-<number>' part ('', '10 mins', ...) falls back to '0:00'
+    minutes = values.str.extract(r'-\s*(\d+)', expand=False).fillna('0')
+    # Python int() rather than astype(int), so an oversized number cannot overflow int64
+    return minutes.map(lambda m: f"0:{int(m):02d}") # Format with leading zero if needed
+
+def escape_quotes(values):
+    """Escapes single quotes for SQL and double quotes for the JSON string."""
+    return (values.str.replace("'", "''", regex=False)
+            .str.replace('"', '\\"', regex=False))
+
+# --- Main Logic Function ---
+def generate_sql_queries(df, location_id, sql_stream):
+    """Processes the DataFrame and writes all SQL queries, UTF-8 encoded, to the binary stream sql_stream."""
+    # Step 3: Clean column names
+    original_columns = list(df.columns)
+    df.columns = df.columns.map(clean_column_name)
+    cleaned_columns = list(df.columns)
+
     # Verify required columns exist after cleaning
     required_cols = list(COLUMN_MAP.values())
     missing_cols = [col for col in required_cols if col not in df.columns]
     if missing_cols:
         raise ValueError(f"Missing required columns after cleaning: {missing_cols}. Check your Excel file headers.")
 
+    # Encode on the fly into the caller's stream instead of building one big string first
+    sql_buffer = io.TextIOWrapper(sql_stream, encoding="utf-8", newline="")
+    sql_buffer.write(f"-- Original Columns: {original_columns}\n")
+    sql_buffer.write(f"-- Cleaned Columns: {cleaned_columns}\n\n")
+
+    # Work on the validated columns only, as text, with empty cells as ''
+    df = df[required_cols].fillna('').astype(str)
+
+    # Step 5: Clean the columns shared by every section once, up front
+    item_id_col = COLUMN_MAP['item_id']
+    item_name_col = COLUMN_MAP['item_name']
+    item_ids = df[item_id_col].str.strip()
+    has_item_id = item_ids.ne('')
+    items = df[has_item_id] # Rows that get an UPDATE, recommendations and filter tags
+    # Few distinct spice levels, so keep them as categorical codes rather than one string per row
+    spice_level_values = df[COLUMN_MAP["spice_level"]].str.strip().astype(pd.CategoricalDtype())
+
     # Step 6: Update queries for mh_items
-    all_sql_output.append("-- Below are UPDATE queries for mh_items")
-    all_sql_output.append("START TRANSACTION;") # Add transaction start
-    update_queries = []
-    for index, row in df.iterrows():
-        try:
-            item_id = str(row.get(COLUMN_MAP['item_id'], '')).strip()
-            if not item_id:
-                all_sql_output.append(f"-- Skipping row {index+2}: Missing item_id")
-                continue # Skip rows with no item_id
-
-            allergic_info = str(row.get(COLUMN_MAP['allergic_info'], '')).replace("'", "''").replace('"', '\\"') # Escape quotes
-            is_kids_friendly = convert_kids_friendly(row.get(COLUMN_MAP['is_kids_friendly'], ''))
-            prep_time = extract_prep_time(row.get(COLUMN_MAP['average_prep_time'], ''))
-            special_instruction = str(row.get(COLUMN_MAP['special_instruction'], '')).replace("'", "''").replace('"', '\\"') # Escape quotes
-
-            # Construct the JSON string manually
-            attributes_json = (
-                f'{{"allergicInfo": "{allergic_info}", '
-                f'"kidsFriendly": {is_kids_friendly}, '
-                f'"prepTimeInMins": "{prep_time}", '
-                f'"specialInstructions": "{special_instruction}"}}'
-            )
-            # Escape single quotes in the final JSON string itself for the SQL query
-            attributes_sql = attributes_json.replace("'", "''")
-
-
-            query = (
-                f"update mh_items set attributes = '{attributes_sql}' "
-                f"where id = '{item_id}';"
-            )
-            update_queries.append(query)
-        except Exception as e:
-             all_sql_output.append(f"-- Error generating UPDATE for row {index+2} (item_id: {item_id}): {e}")
-             continue # Continue with the next row
-
-    all_sql_output.extend(update_queries)
-    all_sql_output.append("COMMIT;") # Add transaction end
-    all_sql_output.append("\n")
+    sql_buffer.write("-- Below are UPDATE queries for mh_items\n")
+    sql_buffer.write("START TRANSACTION;\n") # Add transaction start
+    for index in df.index[~has_item_id]:
+        sql_buffer.write(f"-- Skipping row {index+2}: Missing item_id\n")
+
+    allergic_info = escape_quotes(items[COLUMN_MAP['allergic_info']])
+    special_instruction = escape_quotes(items[COLUMN_MAP['special_instruction']])
+    is_kids_friendly = convert_kids_friendly(items[COLUMN_MAP['is_kids_friendly']])
+    prep_time = extract_prep_time(items[COLUMN_MAP['average_prep_time']])
+
+    # Construct the JSON strings manually, then escape single quotes in them for the SQL query
+    attributes_sql = (
+        '{"allergicInfo": "' + allergic_info + '", '
+        '"kidsFriendly": ' + is_kids_friendly + ', '
+        '"prepTimeInMins": "' + prep_time + '", '
+        '"specialInstructions": "' + special_instruction + '"}'
+    ).str.replace("'", "''", regex=False)
+
+    update_queries = (
+        "update mh_items set attributes = '" + attributes_sql + "' "
+        "where id = '" + item_ids[has_item_id] + "';\n"
+    )
+    sql_buffer.writelines(update_queries)
+    sql_buffer.write("COMMIT;\n") # Add transaction end
+    sql_buffer.write("\n\n")
 
     # Step 8: Explode pairing recommendations
-    all_sql_output.append("-- Below are INSERT queries for mh_item_recommendation")
-    all_sql_output.append("START TRANSACTION;") # Add transaction start
-    pairing_rows = []
-    # Create a mapping from cleaned item names to cleaned item IDs
-    item_name_to_id = df.set_index(COLUMN_MAP["item_name"])[COLUMN_MAP["item_id"]].to_dict()
-
-    for index, row in df.iterrows():
-        try:
-            base_id = str(row.get(COLUMN_MAP["item_id"], '')).strip()
-            rec_list_str = str(row.get(COLUMN_MAP["pairing_recommendation"], '')).strip()
-
-            if not base_id:
-                 all_sql_output.append(f"-- Skipping recommendations for row {index+2}: Missing base item_id")
-                 continue
-
-            if not rec_list_str:
-                 # No recommendations for this item
-                 continue
-
-            rec_list = rec_list_str.split(',')
-
-            for rec in rec_list:
-                rec_name = rec.strip()
-                if not rec_name:
-                    continue
-                recommended_id = item_name_to_id.get(rec_name, 'not found')
-
-                if recommended_id != 'not found':
-                    pairing_rows.append((base_id, recommended_id))
-                else:
-                    all_sql_output.append(f"-- Warning: Recommendation '{rec_name}' for item_id '{base_id}' not found in the Excel data.")
-        except Exception as e:
-             all_sql_output.append(f"-- Error processing recommendations for row {index+2} (item_id: {base_id}): {e}")
-             continue
+    sql_buffer.write("-- Below are INSERT queries for mh_item_recommendation\n")
+    sql_buffer.write("START TRANSACTION;\n") # Add transaction start
+    # Create a mapping from item names to item IDs, for rows that have one (first row wins for duplicate names)
+    item_name_to_id = (
+        items.drop_duplicates(subset=[item_name_col])
+        .set_index(item_name_col)[item_id_col]
+    )
+
+    for index in df.index[~has_item_id]:
+        sql_buffer.write(f"-- Skipping recommendations for row {index+2}: Missing base item_id\n")
+
+    # One (base item_id, recommended name) entry per comma-separated recommendation
+    rec_names = (
+        items[COLUMN_MAP["pairing_recommendation"]]
+        .set_axis(item_ids[has_item_id])
+        .str.split(',').explode().str.strip()
+    )
+    rec_names = rec_names[rec_names.ne('')]
+    recommended_ids = rec_names.map(item_name_to_id)
+    found = recommended_ids.notna()
+
+    for base_id, rec_name in rec_names[~found].items():
+        sql_buffer.write(f"-- Warning: Recommendation '{rec_name}' for item_id '{base_id}' not found in the Excel data.\n")
+    pairing_rows = list(zip(rec_names.index[found], recommended_ids[found]))
 
     # Step 9: Build one big INSERT query for recommendations
     if pairing_rows:
         # Delete existing recommendations for the items being processed first
         # This prevents duplicates if the script is run multiple times for the same items
-        item_ids_with_recommendations = list(set([pair[0] for pair in pairing_rows]))
+        item_ids_with_recommendations = rec_names.index[found].unique().tolist() # Ordered, hash-deduplicated
         if item_ids_with_recommendations:
-             delete_query = f"DELETE FROM mh_item_recommendation WHERE item_id IN ({','.join([f"'{item}'" for item in item_ids_with_recommendations])});"
-             all_sql_output.append(delete_query)
+             delete_query = f"DELETE FROM mh_item_recommendation WHERE item_id IN ({','.join(f"'{item}'" for item in item_ids_with_recommendations)});"
+             sql_buffer.write(delete_query + "\n")
 
         insert_query = "INSERT INTO mh_item_recommendation (item_id, recommended_item_id) VALUES\n"
-        values_part = ",\n".join([f"('{item}', '{rec}')" for item, rec in pairing_rows])
+        values_part = ",\n".join(f"('{item}', '{rec}')" for item, rec in pairing_rows)
         full_insert = insert_query + values_part + ";"
-        all_sql_output.append(full_insert)
+        sql_buffer.write(full_insert + "\n")
     else:
-        all_sql_output.append("-- No valid item recommendations found to insert.")
+        sql_buffer.write("-- No valid item recommendations found to insert.\n")
 
-    all_sql_output.append("COMMIT;") # Add transaction end
-    all_sql_output.append("\n")
+    sql_buffer.write("COMMIT;\n") # Add transaction end
+    sql_buffer.write("\n\n")
 
     # ------------------- Task 3 & 4 -------------------
-    all_sql_output.append("-- Below are queries for Spice Level Tags and their Media")
-    all_sql_output.append("START TRANSACTION;") # Add transaction start
+    sql_buffer.write("-- Below are queries for Spice Level Tags and their Media\n")
+    sql_buffer.write("START TRANSACTION;\n") # Add transaction start
 
     # Step 10: Generate filter tags for unique spice levels
-    # Use .get() and handle potential missing column gracefully
-    spice_levels = df.get(COLUMN_MAP.get("spice_level"), pd.Series()).dropna().astype(str).str.strip().unique()
-    spice_level_to_id = {level: str(uuid.uuid4()) for level in spice_levels if level} # Ensure level is not empty/whitespace
+    spice_levels = spice_level_values.cat.categories # Already unique
+    spice_levels = [level for level in spice_levels if level] # Ensure level is not empty/whitespace
+    # Draw the entropy for every tag id in one call, then slice it into version 4 UUIDs
+    uuid_bytes = os.urandom(16 * len(spice_levels))
+    spice_level_to_id = {
+        level: str(uuid.UUID(bytes=uuid_bytes[i * 16:(i + 1) * 16], version=4))
+        for i, level in enumerate(spice_levels)
+    }
 
     insert_filter_tags = "-- No spice level filter tags to insert." # Default
     if spice_level_to_id:
-        all_sql_output.append("-- INSERT for mh_filter_tag (spice levels)")
-        insert_filter_tags_values = ",\n".join([
+        sql_buffer.write("-- INSERT for mh_filter_tag (spice levels)\n")
+        insert_filter_tags_values = ",\n".join(
             f"('{guid}', '{location_id}', '{name.replace("'", "''")}', '1')" for name, guid in spice_level_to_id.items()
-        ])
+        )
         insert_filter_tags = "INSERT INTO mh_filter_tag (id, location_id, name, is_food_prep) VALUES\n" + insert_filter_tags_values + ";"
-        all_sql_output.append(insert_filter_tags)
+        sql_buffer.write(insert_filter_tags + "\n")
 
     # Step 11: Create mh_item_filter_tag mappings
-    item_filter_links = []
-    if COLUMN_MAP.get("spice_level") in df.columns: # Check if the column exists
-        for index, row in df.iterrows():
-            try:
-                item_id = str(row.get(COLUMN_MAP["item_id"], '')).strip()
-                spice_level = str(row.get(COLUMN_MAP["spice_level"], '')).strip()
-                filter_tag_id = spice_level_to_id.get(spice_level)
-
-                if item_id and filter_tag_id:
-                    item_filter_links.append((item_id, filter_tag_id))
-                elif item_id and spice_level and not filter_tag_id:
-                     # This case should not happen if spice_level_to_id was built correctly,
-                     # but good for debugging if unique levels weren't captured.
-                     pass
-                # else: Missing item_id or no spice level for this item, skip
-
-            except Exception as e:
-                all_sql_output.append(f"-- Error processing item-filter link for row {index+2} (item_id: {item_id}): {e}")
-                continue
+    filter_tag_ids = spice_level_values.map(spice_level_to_id) # Maps the categories, not every row
+    # Missing item_id or no spice level for this item, skip
+    has_link = has_item_id & filter_tag_ids.notna()
+    item_filter_links = list(zip(item_ids[has_link], filter_tag_ids[has_link]))
 
     insert_item_filter_tags = "-- No item-filter tag links to insert." # Default
     if item_filter_links:
         # Delete existing links for the items being processed first
-        item_ids_with_tags = list(set([link[0] for link in item_filter_links]))
+        item_ids_with_tags = item_ids[has_link].unique().tolist() # Ordered, hash-deduplicated
         if item_ids_with_tags:
             # Optimization: Delete only for the tags we are inserting? Or just for the items?
             # Deleting just for the items is safer if tags might change.
-            delete_item_tags_query = f"DELETE FROM mh_item_filter_tag WHERE item_id IN ({','.join([f"'{item}'" for item in item_ids_with_tags])});"
-            all_sql_output.append(delete_item_tags_query)
+            delete_item_tags_query = f"DELETE FROM mh_item_filter_tag WHERE item_id IN ({','.join(f"'{item}'" for item in item_ids_with_tags)});"
+            sql_buffer.write(delete_item_tags_query + "\n")
 
-        all_sql_output.append("-- INSERT for mh_item_filter_tag (spice mapping)")
-        insert_item_filter_tags_values = ",\n".join([f"('{item}', '{tag}')" for item, tag in item_filter_links])
+        sql_buffer.write("-- INSERT for mh_item_filter_tag (spice mapping)\n")
+        insert_item_filter_tags_values = ",\n".join(f"('{item}', '{tag}')" for item, tag in item_filter_links)
         insert_item_filter_tags = "INSERT INTO mh_item_filter_tag (item_id, filter_tag_id) VALUES\n" + insert_item_filter_tags_values + ";"
-        all_sql_output.append(insert_item_filter_tags)
+        sql_buffer.write(insert_item_filter_tags + "\n")
     else:
-         all_sql_output.append("-- No item-filter tag links found to insert.")
+         sql_buffer.write("-- No item-filter tag links found to insert.\n")
 
 
     # Step 12: Generate mh_media entries for spice level filter tags
-    media_queries = []
     if spice_level_to_id:
-        all_sql_output.append("-- INSERT for mh_media (spice level filter images)")
-        for spice_name, guid in spice_level_to_id.items():
-            # Note: This assumes you have a default image file naming convention like GUID.png
-            # You might need a more sophisticated way to map spice levels to actual images.
-            # For this script, we'll use the GUID as the file name.
-            query = (
-                "INSERT INTO `mh_media` (`id`, `entity_type`, `entity_id`, `file_name`, `mime_type`) VALUES "
-                f"('{guid}', 'FILTER', '{guid}', '{guid}.png', 'image/png');" # Use image/png or appropriate mime type
-            )
-            media_queries.append(query)
-        all_sql_output.extend(media_queries)
+        sql_buffer.write("-- INSERT for mh_media (spice level filter images)\n")
+        # Note: This assumes you have a default image file naming convention like GUID.png
+        # You might need a more sophisticated way to map spice levels to actual images.
+        # For this script, we'll use the GUID as the file name.
+        insert_media_values = ",\n".join(
+            f"('{guid}', 'FILTER', '{guid}', '{guid}.png', 'image/png')" for guid in spice_level_to_id.values() # Use image/png or appropriate mime type
+        )
+        insert_media = "INSERT INTO `mh_media` (`id`, `entity_type`, `entity_id`, `file_name`, `mime_type`) VALUES\n" + insert_media_values + ";"
+        sql_buffer.write(insert_media + "\n")
     else:
-         all_sql_output.append("-- No media entries to create for spice level tags.")
+         sql_buffer.write("-- No media entries to create for spice level tags.\n")
 
-    all_sql_output.append("COMMIT;") # Add transaction end
-    all_sql_output.append("\n")
+    sql_buffer.write("COMMIT;\n") # Add transaction end
+    sql_buffer.write("\n\n")
 
-
-    return "\n".join(all_sql_output)
+    # Flush and hand the stream back without closing it
+    sql_buffer.detach()
 
 # --- Streamlit App Layout ---
 st.set_page_config(page_title="MenuHub Data Transformer", layout="wide")
@@ -253,11 +227,21 @@ if st.button("Generate SQL Queries"):
             try:
                 # Read the Excel file
                 status.update(label="Reading Excel file...", state="running")
-                df = pd.read_excel(uploaded_file)
+                # Only parse the mapped columns, as text, with the Rust-based calamine reader
+                mapped_columns = set(COLUMN_MAP.values()) # Looked up once per header
+                # getvalue() returns the whole upload regardless of where a previous rerun left the cursor
+                df = pd.read_excel(
+                    io.BytesIO(uploaded_file.getvalue()),
+                    engine="calamine",
+                    usecols=lambda col: clean_column_name(col) in mapped_columns,
+                    dtype=str,
+                )
 
                 status.update(label="Generating SQL queries...", state="running")
                 # Generate the SQL queries
-                sql_output = generate_sql_queries(df, location_id)
+                sql_io = io.BytesIO() # File-like object in memory for the download
+                generate_sql_queries(df, location_id, sql_io)
+                sql_io.seek(0)
 
                 status.update(label="SQL queries generated successfully!", state="complete", expanded=False)
 
@@ -267,13 +251,9 @@ if st.button("Generate SQL Queries"):
                 st.subheader("Generated SQL Queries")
                 # Use an expander to show the code, as it can be long
                 # with st.expander("View Generated SQL"):
-                #      st.code(sql_output, language='sql')
+                #      st.code(sql_io.getvalue().decode('utf-8'), language='sql')
 
                 # Provide download button
-                # Create a file-like object in memory
-                sql_bytes = sql_output.encode('utf-8')
-                sql_io = io.BytesIO(sql_bytes)
-
                 st.download_button(
                     label="Download SQL File",
                     data=sql_io,